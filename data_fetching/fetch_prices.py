@@ -1,9 +1,10 @@
 import requests
 import time
 
-def fetch_candles(symbol: str, interval: str = '1h', limit: int = 1000):
+def fetch_candles(symbol: str, interval: str = '1h', limit: int = 1000, start_time: int | None = None):
     """
     Pobiera dane świecowe (candlestick) z Binance API.
+    Jeśli podano start_time (ms od epoki), zwraca świece od tego momentu w przód.
     """
     url = 'https://api.binance.com/api/v3/klines'
     params = {
@@ -11,9 +12,11 @@ def fetch_candles(symbol: str, interval: str = '1h', limit: int = 1000):
         'interval': interval,
         'limit': limit
     }
+    if start_time is not None:
+        params['startTime'] = int(start_time)
 
     try:
-        response = requests.get(url, params=params)
+        response = requests.get(url, params=params, timeout=(5, 30))
         response.raise_for_status()
         raw_data = response.json()
 
@@ -1,5 +1,5 @@
 import os
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, func
 from sqlalchemy.orm import sessionmaker
 from dotenv import load_dotenv
 from .models import Base
@@ -30,12 +30,15 @@ def create_all_tables():
 def save_prices(prices: list[dict], symbol: str):
     """
     Zapisuje dane świecowe do bazy danych, pomijając duplikaty.
+    Zwraca liczbę nowych rekordów albo None w przypadku błędu zapisu.
     """
     session = get_session()
     try:
+        # Sprawdzamy tylko timestampy z bieżącej porcji, nie całą historię symbolu
         existing_timestamps = {
             row[0] for row in session.query(CryptoPrice.timestamp)
-                                     .filter(CryptoPrice.symbol == symbol)
+                                     .filter(CryptoPrice.symbol == symbol,
+                                             CryptoPrice.timestamp.in_([p['timestamp'] for p in prices]))
                                      .all()
         }
 
@@ -57,10 +60,29 @@ def save_prices(prices: list[dict], symbol: str):
         session.add_all(new_records)
         session.commit()
         print(f"Zapisano {len(new_records)} nowych rekordów dla {symbol}")
+        return len(new_records)
 
     except Exception as e:
         session.rollback()
         print(f"Błąd zapisu do bazy: {e}")
+        return None
+
+    finally:
+        session.close()
+
+def get_latest_timestamps(symbols: list[str]) -> dict[str, int]:
+    """
+    Zwraca najnowszy zapisany timestamp (ms) dla każdego symbolu.
+    Symbole bez danych w bazie są pomijane. Błędy bazy są przekazywane dalej,
+    żeby brak odczytu nie został pomylony z brakiem danych.
+    """
+    session = get_session()
+    try:
+        rows = (session.query(CryptoPrice.symbol, func.max(CryptoPrice.timestamp))
+                       .filter(CryptoPrice.symbol.in_(symbols))
+                       .group_by(CryptoPrice.symbol)
+                       .all())
+        return {symbol: int(ts) for symbol, ts in rows if ts is not None}
 
     finally:
         session.close()
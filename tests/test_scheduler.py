@@ -0,0 +1,229 @@
+import threading
+
+import pytest
+
+import updater.scheduler as scheduler
+from updater.scheduler import IngestionScheduler
+
+H = 60 * 60 * 1000
+T0 = 500_000 * H  # początek świecy godzinowej (ms)
+
+
+class FakeClock:
+    def __init__(self, now_ms: int):
+        self.now = now_ms / 1000
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class FakeBinance:
+    """
+    Zwraca świece od start_time (lub ostatnie `limit`) aż do bieżącej, jeszcze trwającej świecy.
+    """
+
+    def __init__(self, clock: FakeClock, failing: set[str] = frozenset()):
+        self.clock = clock
+        self.failing = failing
+        self.hanging = set()
+        self.release = threading.Event()
+        self.calls = []
+        self.saved = {}
+
+    def fetch_candles(self, symbol, interval='1h', limit=1000, start_time=None):
+        self.calls.append((symbol, start_time))
+        if symbol in self.hanging:
+            self.release.wait()
+        if symbol in self.failing:
+            return []
+        current = int(self.clock() * 1000) // H * H
+        first = start_time if start_time is not None else current - (limit - 1) * H
+        last = min(current, first + (limit - 1) * H)
+        return [{'timestamp': ts, 'open': 1.0, 'high': 1.0, 'low': 1.0, 'close': 1.0, 'volume': 1.0}
+                for ts in range(first, last + 1, H)]
+
+    def save_prices(self, prices, symbol):
+        self.saved.setdefault(symbol, []).extend(p['timestamp'] for p in prices)
+        return len(prices)
+
+
+@pytest.fixture
+def env(monkeypatch):
+    clock = FakeClock(T0 + 1000)
+    binance = FakeBinance(clock)
+    monkeypatch.setattr(scheduler, 'fetch_candles', binance.fetch_candles)
+    monkeypatch.setattr(scheduler, 'save_prices', binance.save_prices)
+    monkeypatch.setattr(scheduler.random, 'uniform', lambda a, b: b)
+    yield clock, binance
+    binance.release.set()
+
+
+def make_scheduler(monkeypatch, clock, symbols, latest, **kwargs):
+    monkeypatch.setattr(scheduler, 'get_latest_timestamps', lambda syms: dict(latest))
+    kwargs.setdefault('max_sleep', 0.0)
+    kwargs.setdefault('sleep', lambda seconds: None)
+    s = IngestionScheduler(symbols, limit=1000, clock=clock, **kwargs)
+    s.load_state()
+    return s
+
+
+def drain(s: IngestionScheduler):
+    """
+    Wykonuje kroki pętli, dopóki są zadania gotowe do uruchomienia lub w toku.
+    """
+    for _ in range(10_000):
+        s.run_once()
+        if not s._in_flight and (not s._heap or s._heap[0][0] > s._clock()):
+            return
+    raise AssertionError("harmonogram nie ustabilizował się")
+
+
+def next_run_at(s: IngestionScheduler, symbol: str) -> float:
+    return min(run_at for run_at, _, sym in s._heap if sym == symbol)
+
+
+def test_catch_up_is_fetched_in_chunks_and_skips_open_candle(monkeypatch, env):
+    clock, binance = env
+    last = T0 - 2501 * H
+    s = make_scheduler(monkeypatch, clock, ['BTCUSDT'], {'BTCUSDT': last})
+
+    drain(s)
+
+    assert binance.calls == [
+        ('BTCUSDT', last + H),
+        ('BTCUSDT', last + 1000 * H),
+        ('BTCUSDT', last + 1999 * H),
+    ]
+    assert binance.saved['BTCUSDT'] == list(range(last + H, T0, H))
+    assert s.states['BTCUSDT'].last_timestamp == T0 - H
+    assert next_run_at(s, 'BTCUSDT') == (T0 + H) / 1000 + s.grace
+
+
+def test_newest_candle_is_dropped_even_if_local_clock_runs_ahead(monkeypatch, env):
+    clock, binance = env
+    s = make_scheduler(monkeypatch, clock, ['BTCUSDT'], {'BTCUSDT': T0 - 3 * H})
+
+    # Zegar lokalny śpieszy się - uważa świecę T0 za zamkniętą, Binance jeszcze jej nie zamknął
+    clock.now = (T0 + H) / 1000 + 10
+    monkeypatch.setattr(binance, 'clock', lambda: T0 / 1000 + 1800)
+    drain(s)
+
+    assert binance.saved['BTCUSDT'] == [T0 - 2 * H, T0 - H]
+    assert s.states['BTCUSDT'].last_timestamp == T0 - H
+
+
+def test_most_stale_symbols_are_dispatched_first_within_worker_limit(monkeypatch, env):
+    clock, binance = env
+    latest = {'BTCUSDT': T0 - 10 * H, 'ETHUSDT': T0 - 20 * H, 'BNBUSDT': T0 - 5 * H}
+    s = make_scheduler(monkeypatch, clock, ['BTCUSDT', 'ETHUSDT', 'BNBUSDT', 'NEWUSDT'],
+                       latest, workers=2)
+    loaded_at = clock.now
+
+    clock.now += 30.0
+    s._dispatch(clock.now)
+
+    # NEWUSDT nie ma danych, więc jest najbardziej nieaktualny
+    assert {symbol for symbol, _, _ in s._in_flight.values()} == {'NEWUSDT', 'ETHUSDT'}
+    assert sorted((sym, run_at) for run_at, _, sym in s._heap) == [
+        ('BNBUSDT', loaded_at), ('BTCUSDT', loaded_at),
+    ]
+    assert s.stats()['lag_s'] == pytest.approx(30.0)
+
+
+def test_dispatch_order_follows_staleness(monkeypatch, env):
+    clock, binance = env
+    latest = {'BTCUSDT': T0 - 10 * H, 'ETHUSDT': T0 - 20 * H, 'BNBUSDT': T0 - 5 * H}
+    s = make_scheduler(monkeypatch, clock, ['BTCUSDT', 'ETHUSDT', 'BNBUSDT', 'NEWUSDT'],
+                       latest, workers=1)
+
+    drain(s)
+
+    assert [symbol for symbol, _ in binance.calls] == ['NEWUSDT', 'ETHUSDT', 'BTCUSDT', 'BNBUSDT']
+
+
+def test_hung_fetch_times_out_and_frees_the_worker(monkeypatch, env):
+    clock, binance = env
+    binance.hanging = {'HUNGUSDT'}
+    s = make_scheduler(monkeypatch, clock, ['HUNGUSDT', 'BTCUSDT'], {'BTCUSDT': T0 - 3 * H},
+                       workers=1, base_delay=2.0, task_timeout=10.0)
+
+    s.run_once()
+    assert [symbol for symbol, _, _ in s._in_flight.values()] == ['HUNGUSDT']
+
+    clock.now += 10.0
+    s.run_once()
+    assert s._in_flight == {}
+    assert s.states['HUNGUSDT'].failures == 1
+    assert next_run_at(s, 'HUNGUSDT') == clock.now + 2.0
+
+    # Zawieszony wątek nie blokuje kolejnych symboli
+    drain(s)
+    assert binance.saved['BTCUSDT'] == [T0 - 2 * H, T0 - H]
+
+
+def test_failures_back_off_then_open_circuit(monkeypatch, env):
+    clock, binance = env
+    binance.failing = {'BADUSDT'}
+    s = make_scheduler(monkeypatch, clock, ['BADUSDT'], {},
+                       base_delay=2.0, breaker_threshold=3, breaker_cooldown=100.0)
+
+    drain(s)
+    assert next_run_at(s, 'BADUSDT') == clock.now + 2.0
+
+    clock.now += 2.0
+    drain(s)
+    assert next_run_at(s, 'BADUSDT') == clock.now + 4.0
+    assert s.stats()['open_circuits'] == []
+
+    clock.now += 4.0
+    drain(s)
+    assert next_run_at(s, 'BADUSDT') == clock.now + 100.0
+    assert s.stats()['open_circuits'] == ['BADUSDT']
+
+    # Po okresie wstrzymania wykonywana jest jedna próba, po porażce obwód znów się otwiera
+    clock.now += 100.0
+    drain(s)
+    assert len(binance.calls) == 4
+    assert next_run_at(s, 'BADUSDT') == clock.now + 100.0
+
+
+def test_stats_reports_queue_depth_and_lag(monkeypatch, env):
+    clock, _ = env
+    symbols = ['BTCUSDT', 'ETHUSDT', 'BNBUSDT']
+    s = make_scheduler(monkeypatch, clock, symbols, {sym: T0 - 5 * H for sym in symbols})
+
+    clock.now += 30.0
+    stats = s.stats()
+    assert stats['queue_depth'] == 3
+    assert stats['ready'] == 3
+    assert stats['in_flight'] == 0
+    assert stats['lag_s'] == pytest.approx(30.0)
+
+    drain(s)
+    stats = s.stats()
+    assert stats['queue_depth'] == 3
+    assert stats['ready'] == 0
+    assert stats['lag_s'] == 0.0
+    assert stats['staleness_s'] == {sym: pytest.approx(H / 1000 + 31.0) for sym in symbols}
+
+
+def test_load_state_aborts_when_database_is_unavailable(monkeypatch, env):
+    clock, _ = env
+
+    def broken(symbols):
+        raise RuntimeError("brak połączenia")
+
+    monkeypatch.setattr(scheduler, 'get_latest_timestamps', broken)
+    sleeps = []
+    s = IngestionScheduler(['BTCUSDT'], clock=clock, sleep=sleeps.append, startup_retries=3)
+
+    with pytest.raises(RuntimeError):
+        s.load_state()
+    assert len(sleeps) == 2
+    assert s._heap == []
+
+
+def test_unsupported_interval_is_rejected():
+    with pytest.raises(ValueError, match="1M"):
+        IngestionScheduler(['BTCUSDT'], interval='1M')
+    assert IngestionScheduler(['BTCUSDT'], interval='1s').interval_ms == 1000
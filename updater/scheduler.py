@@ -1,22 +1,346 @@
-import schedule
+import heapq
+import itertools
+import random
 import time
-from updater.multi_fetcher import update_all_symbols
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from data_fetching.fetch_prices import fetch_candles
+from database.db_manager import save_prices, get_latest_timestamps
 
 # Lista kryptowalut do śledzenia
 SYMBOLS = ['BTCUSDT', 'ETHUSDT', 'BNBUSDT']
 
-def job():
-    print("🔄 Aktualizacja danych...")
-    update_all_symbols(SYMBOLS)
+INTERVAL_UNITS_MS = {
+    's': 1000,
+    'm': 60 * 1000,
+    'h': 60 * 60 * 1000,
+    'd': 24 * 60 * 60 * 1000,
+    'w': 7 * 24 * 60 * 60 * 1000,
+}
+
+
+def interval_to_ms(interval: str) -> int:
+    """
+    Zamienia interwał w formacie Binance (np. '15m', '1h', '1d') na milisekundy.
+    Interwały o zmiennej długości ('1M') nie są obsługiwane.
+    """
+    count, unit = interval[:-1], interval[-1:]
+    if not count.isdigit() or int(count) < 1 or unit not in INTERVAL_UNITS_MS:
+        raise ValueError(f"Nieobsługiwany interwał: {interval!r} "
+                         f"(dozwolone jednostki: {', '.join(INTERVAL_UNITS_MS)})")
+    return int(count) * INTERVAL_UNITS_MS[unit]
+
+
+class SymbolState:
+    """
+    Stan pobierania danych dla jednego symbolu.
+    """
+
+    def __init__(self, symbol: str, last_timestamp: int | None = None):
+        self.symbol = symbol
+        self.last_timestamp = last_timestamp  # open time ostatniej zamkniętej świecy (ms)
+        self.failures = 0                     # liczba kolejnych nieudanych prób
+        self.circuit_open_until = 0.0         # do kiedy symbol jest wstrzymany (s od epoki)
+
+    def staleness_ms(self, now_ms: int) -> float:
+        if self.last_timestamp is None:
+            return float('inf')
+        return now_ms - self.last_timestamp
+
+
+class IngestionScheduler:
+    """
+    Harmonogram pobierania danych oparty na kopcu zadań uporządkowanym po czasie.
+
+    Każdy symbol ma w kolejce dokładnie jedno zadanie. Spośród zadań gotowych do
+    uruchomienia najpierw wykonywane są te z najbardziej nieaktualnymi danymi.
+    Błędy są ponawiane z wykładniczym opóźnieniem (z losowym rozrzutem), a po
+    serii porażek symbol jest wstrzymywany (circuit breaker). Pominięte okna
+    (np. po przestoju) są doganiane kolejnymi porcjami od ostatniej zapisanej świecy.
+    """
+
+    def __init__(self, symbols: list[str], interval: str = '1h', limit: int = 1000,
+                 workers: int = 4, grace: float = 5.0,
+                 base_delay: float = 5.0, max_delay: float = 300.0,
+                 breaker_threshold: int = 5, breaker_cooldown: float = 900.0,
+                 max_sleep: float = 60.0, report_every: float = 600.0,
+                 startup_retries: int = 5, task_timeout: float = 120.0,
+                 clock=time.time, sleep=time.sleep):
+        if limit < 2:
+            # Najnowsza świeca z każdej odpowiedzi jest odrzucana (patrz _ingest)
+            raise ValueError(f"limit musi wynosić co najmniej 2, podano {limit}")
+        self.interval = interval
+        self.interval_ms = interval_to_ms(interval)
+        self.limit = limit
+        self.workers = workers
+        self.grace = grace
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.breaker_threshold = breaker_threshold
+        self.breaker_cooldown = breaker_cooldown
+        self.max_sleep = max_sleep
+        self.report_every = report_every
+        self.startup_retries = startup_retries
+        self.task_timeout = task_timeout
+        self._clock = clock
+        self._sleep = sleep
+
+        self.states = {symbol: SymbolState(symbol) for symbol in symbols}
+        self._heap = []                 # (run_at, seq, symbol)
+        self._seq = itertools.count()
+        self._in_flight = {}            # future -> (symbol, run_at, started_at)
+        self._pool = ThreadPoolExecutor(max_workers=workers)
+        self._last_report = 0.0
+
+    # --- kolejka -----------------------------------------------------------
+
+    def _push(self, symbol: str, run_at: float):
+        heapq.heappush(self._heap, (run_at, next(self._seq), symbol))
+
+    def _next_due(self, state: SymbolState) -> float:
+        """
+        Czas (s od epoki), w którym zamknie się kolejna świeca dla symbolu.
+        """
+        if state.last_timestamp is None:
+            return self._clock()
+        return (state.last_timestamp + 2 * self.interval_ms) / 1000 + self.grace
+
+    def _missed_windows(self, state: SymbolState, now_ms: int) -> int:
+        """
+        Liczba zamkniętych świec, których jeszcze nie zapisano.
+        """
+        if state.last_timestamp is None:
+            return self.limit
+        return int((now_ms - state.last_timestamp) // self.interval_ms) - 1
+
+    def _backoff_delay(self, failures: int) -> float:
+        delay = min(self.max_delay, self.base_delay * 2 ** (failures - 1))
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def _read_latest_timestamps(self) -> dict[str, int]:
+        """
+        Odczytuje ostatnie zapisane świece, ponawiając próbę przy błędzie bazy.
+        Bez tej informacji nie da się nadrobić przestoju, więc po wyczerpaniu
+        prób start harmonogramu jest przerywany.
+        """
+        for attempt in range(1, self.startup_retries + 1):
+            try:
+                return get_latest_timestamps(list(self.states))
+            except Exception as e:
+                if attempt == self.startup_retries:
+                    raise
+                delay = self._backoff_delay(attempt)
+                print(f"⚠️ Błąd odczytu stanu z bazy: {e}, ponowienie za {delay:.1f} s")
+                self._sleep(delay)
+
+    def load_state(self):
+        """
+        Odczytuje z bazy ostatnie zapisane świece i planuje pierwsze zadania.
+        """
+        for symbol, timestamp in self._read_latest_timestamps().items():
+            self.states[symbol].last_timestamp = timestamp
+
+        now = self._clock()
+        now_ms = int(now * 1000)
+        for symbol, state in self.states.items():
+            missed = self._missed_windows(state, now_ms)
+            if missed > 0 and state.last_timestamp is not None:
+                print(f"⏪ {symbol}: pominięte okna ({missed}), zaplanowano nadrabianie")
+            self._push(symbol, now)
+
+    # --- wykonywanie -------------------------------------------------------
+
+    def _ingest(self, symbol: str, start_time: int | None) -> int:
+        """
+        Pobiera i zapisuje zamknięte świece; zwraca open time ostatniej z nich.
+
+        save_prices nie nadpisuje istniejących rekordów, więc zapisana niepełna
+        świeca zostałaby na stałe. Dlatego najnowsza świeca z odpowiedzi jest
+        zawsze odrzucana: Binance zwraca świece aż do bieżącej, więc jest to
+        albo świeca jeszcze trwająca (niezależnie od zegara lokalnego), albo
+        ostatnia z pełnej porcji, którą pobierze kolejne zapytanie. Dodatkowo
+        pomijane są świece, które według zegara lokalnego się nie zamknęły.
+        """
+        candles = fetch_candles(symbol, interval=self.interval, limit=self.limit, start_time=start_time)
+        candles = sorted(candles, key=lambda c: c['timestamp'])[:-1]
+        now_ms = int(self._clock() * 1000)
+        candles = [c for c in candles if c['timestamp'] + self.interval_ms <= now_ms]
+        if not candles:
+            raise RuntimeError(f"brak zamkniętych świec dla {symbol}")
+        if save_prices(candles, symbol) is None:
+            raise RuntimeError(f"zapis danych dla {symbol} nie powiódł się")
+        return max(c['timestamp'] for c in candles)
+
+    def _dispatch(self, now: float):
+        """
+        Uruchamia gotowe zadania, zaczynając od symboli z najstarszymi danymi.
+        """
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            due.append(heapq.heappop(self._heap))
+
+        now_ms = int(now * 1000)
+        due.sort(key=lambda entry: self.states[entry[2]].staleness_ms(now_ms), reverse=True)
+
+        free = self.workers - len(self._in_flight)
+        for entry in due:
+            run_at, _, symbol = entry
+            state = self.states[symbol]
+            if self._missed_windows(state, now_ms) < 1:
+                # Dane są aktualne - czekamy na kolejną świecę
+                self._push(symbol, self._next_due(state))
+                continue
+            if free <= 0:
+                # Brak wolnych wątków - zadanie zostaje w kolejce z pierwotnym terminem
+                heapq.heappush(self._heap, entry)
+                continue
+
+            start_time = None
+            if state.last_timestamp is not None:
+                start_time = state.last_timestamp + self.interval_ms
+            future = self._pool.submit(self._ingest, symbol, start_time)
+            self._in_flight[future] = (symbol, run_at, now)
+            free -= 1
+
+    def _complete(self, future):
+        symbol, _, _ = self._in_flight.pop(future)
+        state = self.states[symbol]
+        now = self._clock()
+
+        try:
+            latest = future.result()
+        except Exception as e:
+            self._on_failure(state, now, e)
+            return
+
+        if state.failures >= self.breaker_threshold:
+            print(f"✅ {symbol}: wznowiono pobieranie")
+        state.failures = 0
+        state.circuit_open_until = 0.0
+        if state.last_timestamp is None or latest > state.last_timestamp:
+            state.last_timestamp = latest
+
+        if self._missed_windows(state, int(now * 1000)) > 0:
+            # Porcja nie objęła wszystkich zaległych świec
+            print(f"⏪ {symbol}: nadrabianie zaległych danych")
+            self._push(symbol, now)
+        else:
+            self._push(symbol, self._next_due(state))
+
+    def _expire(self, now: float):
+        """
+        Traktuje zadania trwające dłużej niż task_timeout jako nieudane.
+        """
+        expired = [future for future, (_, _, started_at) in self._in_flight.items()
+                   if now - started_at >= self.task_timeout]
+        if not expired:
+            return
+
+        stuck = False
+        for future in expired:
+            symbol, _, _ = self._in_flight.pop(future)
+            stuck |= not future.cancel()
+            self._on_failure(self.states[symbol], now,
+                             TimeoutError(f"przekroczono limit czasu {self.task_timeout:.0f} s"))
+
+        if stuck:
+            # Zawieszony wątek nadal zajmuje miejsce w puli; nowe zadania trafiają
+            # do świeżej puli, a stara kończy się, gdy jej wątki się odblokują
+            self._pool.shutdown(wait=False)
+            self._pool = ThreadPoolExecutor(max_workers=self.workers)
+
+    def _on_failure(self, state: SymbolState, now: float, error: Exception):
+        state.failures += 1
+
+        if state.failures >= self.breaker_threshold:
+            state.circuit_open_until = now + self.breaker_cooldown
+            print(f"⛔ {state.symbol}: {state.failures} błędów z rzędu ({error}), "
+                  f"wstrzymano na {self.breaker_cooldown:.0f} s")
+            self._push(state.symbol, state.circuit_open_until)
+            return
+
+        delay = self._backoff_delay(state.failures)
+        print(f"⚠️ {state.symbol}: {error}, ponowienie za {delay:.1f} s "
+              f"(próba {state.failures + 1})")
+        self._push(state.symbol, now + delay)
+
+    # --- metryki -----------------------------------------------------------
+
+    def stats(self) -> dict:
+        """
+        Zwraca bieżący stan kolejki: głębokość, opóźnienie i nieaktualność danych.
+        """
+        now = self._clock()
+        now_ms = int(now * 1000)
+        waiting = [now - run_at for run_at, _, _ in self._heap if run_at <= now]
+        waiting += [now - run_at for _, run_at, _ in self._in_flight.values()]
+        return {
+            'queue_depth': len(self._heap),
+            'ready': sum(1 for run_at, _, _ in self._heap if run_at <= now),
+            'in_flight': len(self._in_flight),
+            'lag_s': max(waiting, default=0.0),
+            'staleness_s': {
+                symbol: state.staleness_ms(now_ms) / 1000
+                for symbol, state in self.states.items()
+            },
+            'open_circuits': [
+                symbol for symbol, state in self.states.items()
+                if state.circuit_open_until > now
+            ],
+        }
+
+    def _report(self, now: float):
+        if now - self._last_report < self.report_every:
+            return
+        self._last_report = now
+        s = self.stats()
+        max_staleness = max(s['staleness_s'].values(), default=0.0)
+        print(f"📊 Kolejka: {s['queue_depth']} (gotowe: {s['ready']}, w toku: {s['in_flight']}), "
+              f"opóźnienie: {s['lag_s']:.1f} s, najstarsze dane: {max_staleness:.0f} s, "
+              f"wstrzymane: {len(s['open_circuits'])}")
+
+    # --- pętla główna ------------------------------------------------------
+
+    def _sleep_time(self, now: float) -> float:
+        timeout = self.max_sleep
+        if self._heap and len(self._in_flight) < self.workers:
+            timeout = min(timeout, self._heap[0][0] - now)
+        if self._in_flight:
+            deadline = min(started_at for _, _, started_at in self._in_flight.values()) + self.task_timeout
+            timeout = min(timeout, deadline - now)
+        return max(0.0, timeout)
+
+    def run_once(self):
+        """
+        Jeden krok pętli: uruchamia gotowe zadania i obsługuje zakończone.
+        """
+        now = self._clock()
+        self._dispatch(now)
+        timeout = self._sleep_time(now)
+
+        if self._in_flight:
+            done, _ = wait(self._in_flight, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                self._complete(future)
+        elif timeout > 0:
+            self._sleep(timeout)
+
+        self._expire(self._clock())
+        self._report(self._clock())
+
+    def run(self):
+        self.load_state()
+        print(f"🕒 Uruchomiono harmonogram ({len(self.states)} symboli, interwał {self.interval})")
+        try:
+            while True:
+                self.run_once()
+        finally:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+
 
 def run_scheduler():
-    job()  # uruchomienie przy starcie
-    schedule.every().hour.do(job)
+    IngestionScheduler(SYMBOLS).run()
 
-    print("🕒 Uruchomiono harmonogram co godzinę")
-    while True:
-        schedule.run_pending()
-        time.sleep(10)
 
 if __name__ == '__main__':
     run_scheduler()